@@ -1,4 +1,4 @@
-from .engine import Value
+from .engine import CompiledGraph, TensorValue, Value, compile
 from .nn import MLP, Layer, Module, Neuron
 
-__all__ = [Value, Module, Neuron, Layer, MLP]
+__all__ = [Value, TensorValue, CompiledGraph, compile, Module, Neuron, Layer, MLP]
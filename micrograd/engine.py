@@ -1,4 +1,29 @@
-from typing import Tuple, Union
+import itertools
+import sys
+from typing import Callable, List, Tuple, Union
+
+import numpy as np
+
+# The operation codes of the Value nodes. They describe how the node was
+# built from its children, the backward pass dispatches on them instead of
+# calling one Python closure per node.
+_OP_NONE = 0
+_OP_ADD = 1
+_OP_MUL = 2
+_OP_POW = 3
+_OP_RELU = 4
+_OP_DIV = 5
+_OP_DOT = 6
+_OP_ADD_CONST = 7
+_OP_MUL_CONST = 8
+_OP_AFFINE_RELU = 9
+# The matrix product of a TensorValue layer.
+_OP_AFFINE = 10
+
+
+def _noop():
+    # The backward function of the nodes that have no children.
+    pass
 
 
 class Value(object):
@@ -7,33 +32,39 @@ class Value(object):
     raw data into a class that will store metadata to help in automatic
     differentiation.
 
+    The data can also be a batch of numbers (a list or numpy array), in
+    which case a single graph computes the whole batch at once. Plain
+    numbers are kept as Python numbers since they are much faster to
+    operate on than 0-d numpy arrays.
+
     Args:
         data (float): The data for the Value node.
         _children (Tuple): The children of this node.
     """
 
+    # A graph is made of a lot of Value nodes. Declaring the attributes
+    # up front drops the per instance `__dict__`, which roughly halves the
+    # memory of a node and makes the attribute access faster.
+    __slots__ = (
+        "data",
+        "grad",
+        "_backward",
+        "_prev",
+        "_op",
+        "_extra",
+        "_topo",
+        "_visit_tag",
+    )
+
     def __init__(self, data: float, _children: Tuple = ()):
-        # The raw data for the Value node.
-        self.data = data
-
-        # The partial gradient of the last node with respect to this
-        # node. This is also termed as the global gradient.
-        # Gradient 0 means that there is no effect of the change
-        # of the last node with respect to this node. On
-        # initialization it is assumed that all the variables have no
-        # effect on the entire architecture.
-        self.grad = 0.0
-
-        # The function that derives the gradient of the children nodes
-        # of this current node. It is easier this way, because each node
-        # is built from children nodes and an operation. Upon back-propagation
-        # the current node can easily fill in the gradients of the children.
-        # Note: The global gradient is the multiplication of the local gradeint
-        # and the flowing gradient from the parent.
-        self._backward = lambda: None
+        # The raw data for the Value node. A batch is stored as a float64
+        # array, the operations below work on it through broadcasting.
+        if not isinstance(data, (int, float)):
+            data = np.asarray(data, dtype=np.float64)
 
-        # Define the children of this node.
-        self._prev = set(_children)
+        # Set every attribute of the node, the same way as for the nodes
+        # built by the operations (see `_new_node`).
+        _new_node(data, _children, out=self)
 
     def __repr__(self):
         # This is the string representation of the Value node.
@@ -51,26 +82,19 @@ class Value(object):
             >>> z.data
             5
         """
+        # A plain number is a constant, it would never use its gradient.
+        # Instead of wrapping it in its own Value node, it is kept on the
+        # output node, which then has a single child.
+        if isinstance(other, (int, float)):
+            return _new_node(self.data + other, (self,), _OP_ADD_CONST, other)
+
         # If the other value is not a Value, then we need to wrap it.
         other = other if isinstance(other, Value) else Value(other)
 
         # Create a new Value node that will be the output of the addition.
-        out = Value(data=self.data + other.data, _children=(self, other))
-
-        def _backward():
-            # Local gradient:
-            # x = a + b
-            # dx/da = 1
-            # dx/db = 1
-            # Global gradient with chain rule:
-            # dy/da = dy/dx . dx/da = dy/dx . 1
-            # dy/db = dy/dx . dx/db = dy/dx . 1
-            self.grad += out.grad * 1.0
-            other.grad += out.grad * 1.0
-
-        # Set the backward function on the output node.
-        out._backward = _backward
-        return out
+        # The operation is set on the output node, the backward pass uses
+        # it to fill in the gradients of the children (see `_BACKWARD`).
+        return _new_node(self.data + other.data, (self, other), _OP_ADD)
 
     def __radd__(self, other):
         """
@@ -99,27 +123,17 @@ class Value(object):
             >>> z.data
             6
         """
+        # A plain number is a constant, kept on the output node (see
+        # `__add__`).
+        if isinstance(other, (int, float)):
+            return _new_node(self.data * other, (self,), _OP_MUL_CONST, other)
+
         # If the other value is not a Value, then we need to wrap it.
         other = other if isinstance(other, Value) else Value(other)
 
         # Create a new Value node that will be the output of
-        # the multiplication.
-        out = Value(data=self.data * other.data, _children=(self, other))
-
-        def _backward():
-            # Local gradient:
-            # x = a * b
-            # dx/da = b
-            # dx/db = a
-            # Global gradient with chain rule:
-            # dy/da = dy/dx . dx/da = dy/dx . b
-            # dy/db = dy/dx . dx/db = dy/dx . a
-            self.grad += out.grad * other.data
-            other.grad += out.grad * self.data
-
-        # Set the backward function on the output node.
-        out._backward = _backward
-        return out
+        # the multiplication (see `__add__`).
+        return _new_node(self.data * other.data, (self, other), _OP_MUL)
 
     def __rmul__(self, other):
         """
@@ -177,8 +191,9 @@ class Value(object):
             >>> z.data
             1
         """
-        # This is the same as subtracting. We can reuse the __sub__ method.
-        return other - self
+        # This is the same as adding the other value to the negative of
+        # this one. We can reuse the __neg__ and the __add__ methods.
+        return (-self) + other
 
     def __pow__(self, other):
         """
@@ -195,20 +210,9 @@ class Value(object):
             other, (int, float)
         ), "only supporting int/float powers for now"
 
-        # Create a new Value node that will be the output of the power.
-        out = Value(data=self.data ** other, _children=(self,))
-
-        def _backward():
-            # Local gradient:
-            # x = a ** b
-            # dx/da = b * a ** (b - 1)
-            # Global gradient:
-            # dy/da = dy/dx . dx/da = dy/dx . b * a ** (b - 1)
-            self.grad += out.grad * (other * self.data ** (other - 1))
-
-        # Set the backward function on the output node.
-        out._backward = _backward
-        return out
+        # Create a new Value node that will be the output of the power,
+        # the power is stored on the node.
+        return _new_node(self.data ** other, (self,), _OP_POW, float(other))
 
     def __truediv__(self, other):
         """
@@ -220,10 +224,15 @@ class Value(object):
             >>> y = Value(5)
             >>> z = x / y
             >>> z.data
-            2
+            2.0
         """
-        # Use the __pow__ method to implement division.
-        return self * other ** -1
+        # If the other value is not a Value, then we need to wrap it.
+        other = other if isinstance(other, Value) else Value(other)
+
+        # Create a new Value node that will be the output of the division.
+        # This is a single node, instead of going through `__pow__` and
+        # `__mul__` which would create two nodes.
+        return _new_node(self.data / other.data, (self, other), _OP_DIV)
 
     def __rtruediv__(self, other):
         """
@@ -237,8 +246,68 @@ class Value(object):
             >>> z.data
             0.5
         """
-        # Use the __pow__ method to implement division.
-        return other * self ** -1
+        # Wrap the other value and reuse the __truediv__ method.
+        return Value(other) / self
+
+    @staticmethod
+    def dot(ws: List["Value"], xs: List["Value"], b: "Value") -> "Value":
+        """
+        The dot product of `ws` and `xs` plus `b`, as a single Value node.
+        Building it out of `__mul__` and `__add__` would create two nodes
+        for every pair of `ws` and `xs`.
+        Args:
+            ws (List[Value]): The weights.
+            xs (List[Value]): The inputs, plain floats are wrapped.
+            b (Value): The bias.
+        Usage:
+            >>> ws = [Value(2), Value(3)]
+            >>> xs = [Value(4), Value(5)]
+            >>> z = Value.dot(ws, xs, Value(1))
+            >>> z.data
+            24
+        """
+        # The backward pass splits the children back into `ws` and `xs` by
+        # halves, so there has to be exactly one input for every weight.
+        assert len(ws) == len(xs), "dot product of sequences of unequal length"
+
+        # If the inputs are not Values, then we need to wrap them.
+        xs = [x if isinstance(x, Value) else Value(x) for x in xs]
+
+        # Create a new Value node that will be the output of the dot product.
+        s = sum((w.data * x.data for w, x in zip(ws, xs)), b.data)
+        return _new_node(s, (*ws, *xs, b), _OP_DOT)
+
+    @staticmethod
+    def affine_relu(ws: List["Value"], xs: List["Value"], b: "Value") -> "Value":
+        """
+        The relu of the dot product of `ws` and `xs` plus `b`, fused into a
+        single Value node. This is what a neuron with a nonlinearity
+        computes, and it saves the separate relu node of `dot(...).relu()`.
+        Args:
+            ws (List[Value]): The weights.
+            xs (List[Value]): The inputs, plain floats are wrapped.
+            b (Value): The bias.
+        Usage:
+            >>> ws = [Value(2), Value(3)]
+            >>> xs = [Value(4), Value(-5)]
+            >>> z = Value.affine_relu(ws, xs, Value(1))
+            >>> z.data
+            0
+        """
+        # Build the dot product node and apply the relu on the node itself.
+        out = Value.dot(ws, xs, b)
+        if isinstance(out.data, np.ndarray):
+            mask = out.data > 0
+            out.data = np.maximum(0, out.data)
+        else:
+            mask = 1.0 if out.data > 0 else 0.0
+            out.data = 0 if out.data < 0 else out.data
+
+        # Set the operation on the output node, the relu mask is stored on
+        # the node (see `relu`).
+        out._op = _OP_AFFINE_RELU
+        out._extra = mask
+        return out
 
     def relu(self):
         """
@@ -249,23 +318,29 @@ class Value(object):
             >>> y.data
             0
         """
-        out = Value(data=0 if self.data < 0 else self.data, _children=(self,))
-
-        def _backward():
-            # Local gradient:
-            # x = relu(a)
-            # dx/da = 0 if a < 0 else 1
-            # Global gradient:
-            # dy/da = dy/dx . dx/da = dy/dx . (0 if a < 0 else 1)
-            self.grad += out.grad * (out.data > 0)
+        if isinstance(self.data, np.ndarray):
+            # A batch, the relu is applied element-wise.
+            data = np.maximum(0, self.data)
+            mask = data > 0
+        else:
+            data = 0 if self.data < 0 else self.data
+            mask = 1.0 if data > 0 else 0.0
 
-        # Set the backward function on the output node.
-        out._backward = _backward
-        return out
+        # The local gradient (the mask) is decided once here, in the forward
+        # pass, so that the backward pass is a plain multiplication without
+        # a comparison. It is stored on the output node.
+        return _new_node(data, (self,), _OP_RELU, mask)
 
-    def backward(self):
+    def backward(self, free: bool = False):
         """
         The backward pass of the backward propagation algorithm.
+        Args:
+            free (bool): Hand the intermediate nodes of the graph back to be
+                reused by the next operations once the gradients are in.
+                The nodes that are still referred to from elsewhere are kept,
+                only the graph below this node is cut: it becomes a leaf,
+                which keeps its data and gradient. This is meant for the
+                last backward pass of a training step, on the total loss.
         Usage:
             >>> x = Value(2)
             >>> y = Value(3)
@@ -277,21 +352,705 @@ class Value(object):
             2
         """
         # build the topological sorted graph
-        topo = []
-        visited = set()
+        topo = _cached_topo(self)
+
+        # go one variable at a time and apply the chain rule
+        # to get its gradient
+        _run_backward(topo)
+        if free:
+            _free_graph(topo)
+
+
+def _new_node(data, children: Tuple, op: int = _OP_NONE, extra=0.0, out=None) -> Value:
+    """
+    Create the output node of a Value operation. The operations already
+    hold the data in its final form and their children in a tuple, so this
+    skips the conversions of `Value.__init__` and sets every attribute
+    directly, the operation included. Given `out`, the attributes of that
+    node are set instead, this is how `Value.__init__` sets them and how
+    the nodes put in the pool are reset: this is the one place that lists
+    the attributes of a node.
+    """
+    if out is None:
+        out = _value_pool.pop() if _value_pool else _new_value(Value)
+    out.data = data
+
+    # The partial gradient of the last node with respect to this
+    # node. This is also termed as the global gradient.
+    # Gradient 0 means that there is no effect of the change
+    # of the last node with respect to this node. On
+    # initialization it is assumed that all the variables have no
+    # effect on the entire architecture.
+    out.grad = 0.0
+
+    # The function that derives the gradient of the children nodes
+    # of this current node. It is easier this way, because each node
+    # is built from children nodes and an operation. Upon back-propagation
+    # the current node can easily fill in the gradients of the children.
+    # Note: The global gradient is the multiplication of the local gradeint
+    # and the flowing gradient from the parent.
+    # The built-in operations do not set it, they set `_op` instead and
+    # their backward function is looked up in `_BACKWARD`. It is only
+    # used by nodes with a custom backward function, leaf nodes share a
+    # single no-op function.
+    out._backward = _noop
+
+    # Define the children of this node. The tuple is kept as is (in
+    # operand order) instead of being turned into a set: ops have at
+    # most two children and a child that appears twice is harmless
+    # since the topological sort keeps track of the visited nodes.
+    out._prev = children
+
+    # The operation that built this node and any scalar that is not a
+    # node (a constant operand, the power for `__pow__`, the mask for
+    # `relu`). Leaf nodes and nodes with a custom `_backward` function
+    # keep `_OP_NONE`.
+    out._op = op
+    out._extra = extra
+
+    # The topological order of the graph below this node, filled in by
+    # the first call to `backward` (see `_cached_topo`).
+    out._topo = None
+
+    # The tag of the last topological sort that visited this node (see
+    # `_build_topo`).
+    out._visit_tag = 0
+    return out
+
+
+# Allocate a Value without calling `__init__`.
+_new_value = object.__new__
+
+# The intermediate nodes handed back by `backward(free=True)`. Every step of
+# a training loop builds a graph of the same size, so the nodes of the last
+# step are reused for the next one instead of being freed and allocated
+# again. The pool is capped so that a single large graph does not keep its
+# nodes around for good, the nodes beyond the cap are simply freed.
+_value_pool: List["Value"] = []
+_VALUE_POOL_SIZE = 10000
+
+
+def _free_graph(topo: List):
+    """
+    Put the intermediate Value nodes of the graph that nothing else refers
+    to in the pool. A node that is still held, by the caller (e.g. a hidden
+    activation kept around) or by another graph (e.g. a second loss built
+    on the same nodes), is left alone and so are all the nodes below it.
+    The leaves are left alone too, and so is the root (the last node) but
+    for its links to the graph, so that its data and gradient can still be
+    read. The root is a leaf afterwards.
+    """
+    root = topo.pop()
+    grad = root.grad
+    _new_node(root.data, (), out=root)
+    root.grad = grad
+
+    # Without reference counts (off CPython) there is no telling whether a
+    # node is still held, so nothing is pooled.
+    getrefcount = getattr(sys, "getrefcount", None)
+    if getrefcount is None:
+        return
+
+    # Going from the root down, a node whose parents were all freed is only
+    # referred to by `topo`: the freed parents let go of their children. A
+    # node still held keeps its children, which then have too many
+    # references to be freed in turn. The loop first meets a fresh object
+    # that only `topo` refers to, its count is the one of an unshared node.
+    topo.append(object())
+    unshared = None
+    pool = _value_pool
+    for v in reversed(topo):
+        if unshared is None:
+            unshared = getrefcount(v)
+            continue
+        if type(v) is not Value or not v._prev:
+            continue
+        if getrefcount(v) > unshared:
+            continue
+        # Drop every reference the node holds, the children, a closure or
+        # an array, so that the pool keeps nothing else alive.
+        _new_node(0.0, (), out=v)
+        if len(pool) < _VALUE_POOL_SIZE:
+            pool.append(v)
+    topo.pop()
+
+
+# The backward functions of the Value operations. Each one fills in the
+# gradients of the children of `node` from the gradient of `node`. They are
+# plain functions looked up by the operation code of the node, instead of a
+# closure allocated for every node in the forward pass.
+
+
+def _custom_backward(node):
+    # Leaf nodes and nodes with their own `_backward` function (this is
+    # also how TensorValue nodes take part in the backward pass).
+    node._backward()
+
+
+def _add_backward(node):
+    # Local gradient:
+    # x = a + b
+    # dx/da = 1
+    # dx/db = 1
+    # Global gradient with chain rule:
+    # dy/da = dy/dx . dx/da = dy/dx . 1
+    # dy/db = dy/dx . dx/db = dy/dx . 1
+    a, b = node._prev
+    a.grad += node.grad
+    b.grad += node.grad
+
+
+def _mul_backward(node):
+    # Local gradient:
+    # x = a * b
+    # dx/da = b
+    # dx/db = a
+    # Global gradient with chain rule:
+    # dy/da = dy/dx . dx/da = dy/dx . b
+    # dy/db = dy/dx . dx/db = dy/dx . a
+    a, b = node._prev
+    a.grad += node.grad * b.data
+    b.grad += node.grad * a.data
+
+
+def _add_const_backward(node):
+    # Same as `_add_backward`, the constant gets no gradient.
+    (a,) = node._prev
+    a.grad += node.grad
+
+
+def _mul_const_backward(node):
+    # Same as `_mul_backward`, with the constant stored on the node.
+    (a,) = node._prev
+    a.grad += node.grad * node._extra
+
+
+def _pow_backward(node):
+    # Local gradient:
+    # x = a ** p
+    # dx/da = p * a ** (p - 1)
+    # Global gradient:
+    # dy/da = dy/dx . dx/da = dy/dx . p * a ** (p - 1)
+    (a,) = node._prev
+    p = node._extra
+    a.grad += node.grad * (p * a.data ** (p - 1))
+
+
+def _relu_backward(node):
+    # Local gradient:
+    # x = relu(a)
+    # dx/da = 0 if a < 0 else 1
+    # Global gradient:
+    # dy/da = dy/dx . dx/da = dy/dx . (0 if a < 0 else 1)
+    # The local gradient (the mask) is stored on the node.
+    (a,) = node._prev
+    a.grad += node.grad * node._extra
+
+
+def _div_backward(node):
+    # Local gradient:
+    # x = a / b
+    # dx/da = 1 / b
+    # dx/db = -a / b ** 2
+    # Global gradient with chain rule:
+    # dy/da = dy/dx . dx/da = dy/dx . 1 / b
+    # dy/db = dy/dx . dx/db = dy/dx . -a / b ** 2
+    a, b = node._prev
+    inv = 1.0 / b.data
+    a.grad += node.grad * inv
+    b.grad -= node.grad * a.data * inv * inv
+
+
+def _dot_backward(node, g=None):
+    # Local gradient:
+    # x = w1 * x1 + w2 * x2 + ... + b
+    # dx/dwi = xi
+    # dx/dxi = wi
+    # dx/db = 1
+    # The children are laid out as (*ws, *xs, b).
+    prev = node._prev
+    n = (len(prev) - 1) // 2
+    g = node.grad if g is None else g
+    for w, x in zip(prev[:n], prev[n:-1]):
+        w.grad += g * x.data
+        x.grad += g * w.data
+    prev[-1].grad += g
+
+
+def _affine_relu_backward(node):
+    # Local gradient:
+    # x = relu(w1 * x1 + w2 * x2 + ... + b)
+    # The gradient goes through the relu mask first, once for all the
+    # children, then on to the children as for the dot product.
+    _dot_backward(node, node.grad * node._extra)
+
+
+def _affine_backward(node):
+    # Local gradient:
+    # o = W @ x + b
+    # do/dW = x (outer product with the flowing gradient)
+    # do/db = 1
+    # do/dx = W
+    # A batch of inputs of shape (batch, nin) is supported as well.
+    W, x, b = node._prev
+    g = node.grad.reshape(-1, W.data.shape[0])
+    W.grad += g.T @ x.data.reshape(-1, W.data.shape[1])
+    b.grad += g.sum(axis=0)
+    x.grad += node.grad @ W.data
+
+
+# The backward functions indexed by operation code.
+_BACKWARD = [None] * (_OP_AFFINE + 1)
+_BACKWARD[_OP_NONE] = _custom_backward
+_BACKWARD[_OP_ADD] = _add_backward
+_BACKWARD[_OP_MUL] = _mul_backward
+_BACKWARD[_OP_POW] = _pow_backward
+_BACKWARD[_OP_RELU] = _relu_backward
+_BACKWARD[_OP_DIV] = _div_backward
+_BACKWARD[_OP_DOT] = _dot_backward
+_BACKWARD[_OP_ADD_CONST] = _add_const_backward
+_BACKWARD[_OP_MUL_CONST] = _mul_const_backward
+_BACKWARD[_OP_AFFINE_RELU] = _affine_relu_backward
+_BACKWARD[_OP_AFFINE] = _affine_backward
+
+
+def _backward_pass(topo: List):
+    """
+    Go one node at a time, in reverse topological order, and apply the
+    chain rule to fill in the gradients of its children.
+    """
+    backward = _BACKWARD
+    for v in reversed(topo):
+        backward[v._op](v)
+
+
+def _run_backward(topo: List):
+    """
+    The backward pass from the root of `topo` (its last node), seeded with
+    a gradient of 1 for every entry of the root.
+    """
+    root = topo[-1]
+    batched = _zero_inner_grads(topo)
+    root.grad = np.ones_like(root.data) if isinstance(root.data, np.ndarray) else 1
+    if batched:
+        _batched_backward_pass(topo)
+    else:
+        _backward_pass(topo)
+
 
-        def build_topo(v):
-            if v not in visited:
-                visited.add(v)
-                for child in v._prev:
-                    build_topo(child)
-                topo.append(v)
+def _zero_inner_grads(topo: List) -> bool:
+    """
+    Zero the gradients of the nodes built by an operation before a backward
+    pass. Such a node holds the gradient of the last backward pass through
+    it, which has already reached the leaves. A second pass through it (on
+    the same root, or on another loss built on the same nodes) would pass
+    that gradient on once more. Only the leaves accumulate their gradients.
+    Returns whether a Value node of the graph holds a batch.
+    """
+    batched = False
+    for v in topo:
+        if type(v) is Value:
+            if v._prev:
+                v.grad = 0.0
+            if not batched and isinstance(v.data, np.ndarray):
+                batched = True
+        elif v._prev:
+            v.grad.fill(0.0)
+    return batched
+
+
+def _batched_backward_pass(topo: List):
+    """
+    The backward pass of a graph in which some Value nodes hold a batch. A
+    node whose data is smaller than the batch (e.g. a scalar weight, or an
+    entry picked out of a TensorValue) receives one gradient for every
+    example. Since the gradient is linear in these contributions, summing
+    them over the broadcast dimensions gives the gradient of the node.
+
+    Each contribution is summed as it comes in: the Value children of a node
+    are given a zero gradient before its backward function runs, what they
+    receive is summed to the shape of their data and then added to what
+    they held. Every gradient so keeps the shape of the data, both for the
+    backward functions that read it later in the pass and for the gradient
+    left in a leaf by an earlier pass.
+    """
+    backward = _BACKWARD
+    for v in reversed(topo):
+        # A child that appears twice is only handled once.
+        children = [c for c in dict.fromkeys(v._prev) if type(c) is Value]
+        held = [c.grad for c in children]
+        for c in children:
+            c.grad = 0.0
+        backward[v._op](v)
+        for c, g in zip(children, held):
+            grad = c.grad
+            if isinstance(grad, np.ndarray):
+                grad = _sum_to_shape(grad, np.shape(c.data))
+            c.grad = g + grad
+
+
+def _sum_to_shape(grad: np.ndarray, shape: Tuple) -> Union[np.ndarray, float]:
+    # Sum the gradient of a node over the dimensions that broadcasting added
+    # to its data, a node holding a single number gets a float back.
+    if grad.shape == shape:
+        return grad if shape else float(grad)
+
+    # Sum over the leading dimensions that broadcasting added, then
+    # over the dimensions that were broadcast from size 1.
+    grad = grad.sum(axis=tuple(range(grad.ndim - len(shape))))
+    axes = tuple(i for i, n in enumerate(shape) if n == 1 and grad.shape[i] != 1)
+    grad = grad.sum(axis=axes, keepdims=True) if axes else grad
+    return grad if shape else float(grad)
+
+
+# The tags of the topological sorts, never reused so that a node can not be
+# mistaken as visited by a later sort.
+_visit_tags = itertools.count(1)
+
+
+def _build_topo(root) -> List:
+    """
+    Sort the graph below `root` topologically, i.e. every node comes after
+    all of its children. This is a depth first search that keeps its own
+    stack instead of recursing, so deep graphs do not hit the recursion
+    limit of Python. Each node is pushed twice: once to visit its children
+    and once more, marked as processed, to be appended after them.
+    """
+    # Instead of a set of the visited nodes, every sort gets a new tag and
+    # marks the nodes it visits with it. Comparing an int attribute is
+    # faster than hashing the node, and no set has to be built.
+    tag = next(_visit_tags)
+    topo = []
+    stack = [(root, False)]
+    while stack:
+        v, processed = stack.pop()
+        if processed:
+            # All the children of this node are already in the list.
+            topo.append(v)
+            continue
+        if v._visit_tag == tag:
+            continue
+        v._visit_tag = tag
+        stack.append((v, True))
+        for child in v._prev:
+            # Skip the children that are already visited, saves a push and
+            # a pop for every node that is shared between parents.
+            if child._visit_tag != tag:
+                stack.append((child, False))
+    return topo
+
+
+def _cached_topo(root) -> List:
+    """
+    The topological order of the graph below `root`, sorted only once. The
+    children of a node never change after it is created, so neither does
+    the order and calling `backward` again on the same node (e.g. to take
+    the gradients for several losses built on it) skips the sort.
+    """
+    topo = root._topo
+    if topo is None:
+        topo = _build_topo(root)
+        # `root` is always the last node. It is left out of the cached list
+        # so that the node does not hold a reference to itself, which would
+        # keep the whole graph alive until the cycle collector runs.
+        root._topo = topo[:-1]
+        return topo
+    return topo + [root]
+
+
+class TensorValue(object):
+    """
+    The tensor counterpart of the Value node. Instead of wrapping a single
+    scalar, it wraps an entire numpy array. This lets a whole layer of
+    neurons be a single node in the graph, so the forward and backward
+    passes become a handful of numpy (BLAS) calls instead of one Python
+    object and one closure per scalar multiply-add.
+
+    Args:
+        data (np.ndarray): The data for the TensorValue node.
+        _children (Tuple): The children of this node.
+    """
+
+    def __init__(self, data: np.ndarray, _children: Tuple = ()):
+        # The raw data for the TensorValue node, always stored as a
+        # float64 array so that it matches the precision of Value.
+        self.data = np.asarray(data, dtype=np.float64)
+
+        # The gradient has the same shape as the data, each entry being
+        # the global gradient of the corresponding entry of the data.
+        self.grad = np.zeros_like(self.data)
+
+        # The function that fills in the gradients of the children
+        # nodes (see Value for details).
+        self._backward = lambda: None
+
+        # Define the children of this node (see Value).
+        self._prev = _children
+
+        # The cached topological order of the graph (see Value).
+        self._topo = None
+        self._visit_tag = 0
+
+        # The operation the node was built with and its operand, the
+        # relu mask (see Value).
+        self._op = _OP_NONE
+        self._extra = None
+
+    def __repr__(self):
+        # This is the string representation of the TensorValue node.
+        return f"TensorValue(data={self.data}, grad={self.grad})"
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, idx) -> Union["Value", "TensorValue"]:
+        """
+        Pick a single entry of the tensor as a scalar Value, or a part of it
+        (e.g. a row of a batch) as a TensorValue. The gradient that flows
+        into the picked part is routed back into the tensor.
+        Usage:
+            >>> x = TensorValue([2.0, 3.0])
+            >>> y = x[1] * 2
+            >>> y.data
+            6.0
+            >>> X = TensorValue([[2.0, 3.0], [4.0, 5.0]])
+            >>> X[1].data
+            array([4., 5.])
+        """
+        data = self.data[idx]
+        if np.ndim(data):
+            out = TensorValue(data=data, _children=(self,))
+        else:
+            out = Value(data=float(data), _children=(self,))
+
+        def _backward():
+            # Only the picked entries receive the gradient. An entry picked
+            # more than once gets every contribution, `+=` would keep only
+            # one of them.
+            np.add.at(self.grad, idx, out.grad)
+
+        # Set the backward function on the output node.
+        out._backward = _backward
+        return out
+
+    @staticmethod
+    def stack(values: List["Value"]) -> "TensorValue":
+        """
+        Stack a list of Value nodes into a single TensorValue. The gradient
+        of the tensor is scattered back into the Value nodes. The Values are
+        stacked along the last axis, so that Values holding a batch give a
+        tensor of shape (batch, len(values)), one row per example.
+        Usage:
+            >>> x = TensorValue.stack([Value(2.0), Value(3.0)])
+            >>> x.data
+            array([2., 3.])
+            >>> X = TensorValue.stack([Value([1.0, 2.0]), Value([3.0, 4.0])])
+            >>> X.data
+            array([[1., 3.],
+                   [2., 4.]])
+        """
+        # A Value holding a single number is broadcast over the batch.
+        data = np.broadcast_arrays(*[v.data for v in values])
+        out = TensorValue(data=np.stack(data, axis=-1), _children=tuple(values))
+
+        def _backward():
+            # Each Value receives the gradient of its own entry, summed over
+            # the batch if the Value holds a single number.
+            for i, v in enumerate(values):
+                v.grad += _sum_to_shape(out.grad[..., i], np.shape(v.data))
+
+        # Set the backward function on the output node.
+        out._backward = _backward
+        return out
+
+    @staticmethod
+    def affine(W: "TensorValue", x: "TensorValue", b: "TensorValue") -> "TensorValue":
+        """
+        The affine transform `W @ x + b` of a whole layer at once, row `i`
+        of `W` holding the weights of the `i`-th neuron. A batch of inputs
+        of shape (batch, nin) is supported as well.
+        Usage:
+            >>> W = TensorValue([[1.0, 2.0], [3.0, 4.0]])
+            >>> x = TensorValue([1.0, -1.0])
+            >>> y = TensorValue.affine(W, x, TensorValue([0.5, 0.5]))
+            >>> y.data
+            array([-0.5, -0.5])
+        """
+        out = TensorValue(data=x.data @ W.data.T + b.data, _children=(W, x, b))
+        out._op = _OP_AFFINE
+        return out
+
+    def relu(self):
+        """
+        The element-wise relu activation function.
+        Usage:
+            >>> x = TensorValue([-2.0, 3.0])
+            >>> y = x.relu()
+            >>> y.data
+            array([0., 3.])
+        """
+        out = TensorValue(data=np.maximum(0, self.data), _children=(self,))
+
+        # The mask of the entries that let the gradient through, computed
+        # in the forward pass so that the backward pass is a single
+        # element-wise multiplication and does not go over the data again.
+        # The backward function is the same as for Value.relu.
+        out._op = _OP_RELU
+        out._extra = out.data > 0
+        return out
 
-        # call the `build_topo` method on self
-        build_topo(self)
+    def backward(self):
+        """
+        The backward pass of the backward propagation algorithm. The
+        gradient of every entry of this node with respect to itself is 1.
+        Usage:
+            >>> x = TensorValue([2.0, 3.0])
+            >>> y = x.relu()
+            >>> y.backward()
+            >>> x.grad
+            array([1., 1.])
+        """
+        # build the topological sorted graph
+        topo = _cached_topo(self)
 
         # go one variable at a time and apply the chain rule
         # to get its gradient
-        self.grad = 1
-        for v in reversed(topo):
-            v._backward()
+        _run_backward(topo)
+
+
+def _affine_forward(node):
+    # Same as TensorValue.affine, on the data of the recorded children.
+    W, x, b = node._prev
+    node.data = x.data @ W.data.T + b.data
+
+
+def _relu_forward(node):
+    # Same as TensorValue.relu, the mask is recomputed with the data.
+    (a,) = node._prev
+    node.data = np.maximum(0, a.data)
+    node._extra = node.data > 0
+
+
+# The forward functions indexed by operation code, for the operations that
+# a CompiledGraph can replay.
+_FORWARD = [None] * (_OP_AFFINE + 1)
+_FORWARD[_OP_RELU] = _relu_forward
+_FORWARD[_OP_AFFINE] = _affine_forward
+
+
+class CompiledGraph(object):
+    """
+    A graph recorded once and replayed on every call. During training the
+    structure of the graph is the same at every step, only the data of the
+    leaves (the inputs and the parameters) changes. Instead of building a
+    new graph and sorting it at every step, the nodes recorded on the first
+    call are kept in topological order and their data is recomputed in
+    place from the new inputs and the current parameters.
+
+    Args:
+        fn (Callable): The function to compile (e.g. an MLP), called with a
+            TensorValue of the inputs and returning a TensorValue.
+        example_inputs (np.ndarray): The inputs to record the graph with.
+    """
+
+    def __init__(self, fn, example_inputs: np.ndarray):
+        self.fn = fn
+
+        # The recorded graphs keyed by the shape of the inputs. A batch of
+        # a different size gives differently shaped nodes, so it is
+        # recorded again instead of replaying the graph of another shape.
+        self._traces = {}
+        self._trace(np.asarray(example_inputs, dtype=np.float64))
+
+    def _trace(self, x: np.ndarray) -> Tuple:
+        # Record the graph by running the function once, the graph then
+        # already holds the forward pass of these inputs.
+        inp = TensorValue(data=x)
+        out = self.fn(inp)
+        topo = _build_topo(out)
+
+        # Only the nodes built by an operation are recomputed, the leaves
+        # keep their data (the parameters are updated in place anyway).
+        tape = [v for v in topo if v._prev]
+        for v in topo:
+            if type(v) is not TensorValue or (v._prev and _FORWARD[v._op] is None):
+                raise ValueError(f"can not compile a graph holding {v!r}")
+        trace = (inp, out, topo, tape)
+        self._traces[x.shape] = trace
+        return trace
+
+    def _replay(self, inputs: np.ndarray) -> Tuple:
+        x = np.asarray(inputs, dtype=np.float64)
+        trace = self._traces.get(x.shape)
+        if trace is None:
+            return self._trace(x)
+
+        # Go one node at a time in topological order and recompute its
+        # data from the data of its children.
+        inp, out, topo, tape = trace
+        inp.data = x
+        forward = _FORWARD
+        for v in tape:
+            forward[v._op](v)
+        return trace
+
+    def __call__(self, inputs: np.ndarray) -> np.ndarray:
+        """
+        The forward pass only, returns the data of the output.
+        """
+        return self._replay(inputs)[1].data
+
+    def step(
+        self, inputs: np.ndarray, out_grad: Union[np.ndarray, Callable] = None
+    ) -> np.ndarray:
+        """
+        The forward and the backward pass. The gradients are accumulated in
+        the `grad` of the parameters, as `backward` does, and the data of
+        the output is returned.
+        Args:
+            inputs (np.ndarray): The inputs of this step.
+            out_grad (np.ndarray, Callable): The gradient of the loss with
+                respect to the output, or a function that computes it from
+                the data of the output. The loss itself is not part of the
+                graph, e.g. for the mean squared error to the targets `y`:
+                `lambda out: 2 * (out - y) / out.size`. Without it the
+                gradient is all ones, as for `backward`.
+        Usage:
+            >>> from micrograd.nn import MLP
+            >>> model = MLP(3, [4, 1])
+            >>> graph = compile(model, np.zeros(3))
+            >>> out = graph.step([1.0, -2.0, 0.5], lambda out: 2 * (out - 1.0))
+            >>> model.layers[0].W.grad.shape
+            (4, 3)
+        """
+        inp, out, topo, tape = self._replay(inputs)
+
+        # The nodes of the graph are reused, so the gradients of the
+        # previous step are zeroed first. The shapes do not change, the
+        # arrays are filled in place.
+        for v in tape:
+            v.grad.fill(0.0)
+        inp.grad.fill(0.0)
+
+        # Seed the backward pass with the gradient of the loss, which needs
+        # the output of this step when it is a function.
+        if out_grad is None:
+            out.grad.fill(1.0)
+        else:
+            out.grad[...] = out_grad(out.data) if callable(out_grad) else out_grad
+        _backward_pass(topo)
+        return out.data
+
+
+def compile(fn, example_inputs: np.ndarray) -> "CompiledGraph":
+    """
+    Record the graph of `fn` on `example_inputs` once, to be replayed on
+    every later call (see CompiledGraph).
+    Usage:
+        >>> from micrograd.nn import MLP
+        >>> model = MLP(3, [4, 1])
+        >>> graph = compile(model, np.zeros((8, 3)))
+        >>> graph(np.ones((8, 3))).shape
+        (8, 1)
+    """
+    return CompiledGraph(fn, example_inputs)
@@ -1,7 +1,9 @@
 import random
-from typing import List
+from typing import List, Union
 
-from .engine import Value
+import numpy as np
+
+from .engine import TensorValue, Value
 
 
 class Module(object):
@@ -39,11 +41,11 @@ class Neuron(Module):
 
     def __call__(self, x: List["Value"]) -> "Value":
         # Compute the dot product of the input and the weights. Add the
-        # bias to the dot product.
-        act = sum((wi * xi for wi, xi in zip(self.w, x)), self.b)
-
-        # If activation is mentioned apply ReLU to it.
-        return act.relu() if self.nonlin else act
+        # bias to the dot product. If activation is mentioned apply ReLU to
+        # it. Either way this is a single node in the graph.
+        if self.nonlin:
+            return Value.affine_relu(self.w, x, self.b)
+        return Value.dot(self.w, x, self.b)
 
     def parameters(self):
         # Get the parameters of the neuron. The parameters of a neuron
@@ -57,28 +59,79 @@ class Neuron(Module):
 
 class Layer(Module):
     """
-    A layer of neurons.
+    A layer of neurons. Instead of holding a list of Neuron objects, the
+    weights of all the neurons are stored in a single matrix so that the
+    whole layer is computed with one matrix-vector product.
     Parameters:
         nin (int): number of inputs
         nout (int): number of outputs
+        nonlin (bool): whether to apply ReLU nonlinearity
     """
 
-    def __init__(self, nin: int, nout: int, **kwargs):
-        # A layer is a list of neurons.
-        self.neurons = [Neuron(nin, **kwargs) for _ in range(nout)]
+    def __init__(self, nin: int, nout: int, nonlin: bool = True):
+        # Create the weights of the layer. Row `i` of the matrix holds
+        # the weights of the `i`-th neuron. The weights are initialized
+        # from a random uniform distribution.
+        self.W = TensorValue(data=np.random.uniform(-1, 1, (nout, nin)))
+
+        # Create the biases of the layer, one for each neuron.
+        self.b = TensorValue(data=np.zeros(nout))
+        self.nonlin = nonlin
+
+    # The weights and biases are kept as a structure of arrays: one
+    # contiguous array for the data and one for the gradients of all the
+    # neurons, instead of one Value object per weight scattered over the
+    # heap. The rows (e.g. `W_data[i]`) are views on the `i`-th neuron.
+    @property
+    def W_data(self) -> np.ndarray:
+        return self.W.data
+
+    @property
+    def W_grad(self) -> np.ndarray:
+        return self.W.grad
+
+    @property
+    def b_data(self) -> np.ndarray:
+        return self.b.data
+
+    @property
+    def b_grad(self) -> np.ndarray:
+        return self.b.grad
+
+    def __call__(self, x: Union[List["Value"], "TensorValue"]) -> "TensorValue":
+        # Bring the input into a TensorValue. A list holding Value nodes is
+        # stacked so that the gradients still reach the Value nodes, plain
+        # numbers in it are wrapped (see Value.dot).
+        if not isinstance(x, TensorValue):
+            if not isinstance(x, np.ndarray) and any(isinstance(v, Value) for v in x):
+                x = TensorValue.stack(
+                    [v if isinstance(v, Value) else Value(v) for v in x]
+                )
+            else:
+                x = TensorValue(data=x)
+
+        # Compute the dot products of the input with the weights of every
+        # neuron at once and add the biases.
+        out = TensorValue.affine(self.W, x, self.b)
+
+        # If activation is mentioned apply ReLU to it.
+        return out.relu() if self.nonlin else out
 
-    def __call__(self, x: List["Value"]) -> List["Value"]:
-        # Iterate over all the neurons and compute the output of each.
-        out = [n(x) for n in self.neurons]
-        return out
+    def zero_grad(self):
+        # Zero out the gradient arrays in place, a single fill per array
+        # instead of one Python statement per parameter.
+        self.W_grad.fill(0.0)
+        self.b_grad.fill(0.0)
 
     def parameters(self):
-        # The parameters of a layer is the parameters of all the neurons.
-        return [p for n in self.neurons for p in n.parameters()]
+        # The parameters of a layer are its weight matrix and bias vector.
+        return [self.W, self.b]
 
     def __repr__(self):
         # Print a better representation of the layer.
-        return f"Layer of [{', '.join(str(n) for n in self.neurons)}]"
+        nout, nin = self.W.data.shape
+        neuron = f"{'ReLU' if self.nonlin else 'Linear'} Neuron({nin})"
+        return f"Layer of [{', '.join([neuron] * nout)}]"
 
 
 class MLP(Module):
@@ -101,13 +154,18 @@ class MLP(Module):
             for i in range(len(nouts))
         ]
 
-    def __call__(self, x: List["Value"]) -> List["Value"]:
+    def __call__(self, x: Union[List["Value"], "TensorValue"]) -> "TensorValue":
         # Iterate over the layers and compute the output of
         # each sequentially.
         for layer in self.layers:
             x = layer(x)
         return x
 
+    def zero_grad(self):
+        # Let every layer zero out its own gradient arrays.
+        for layer in self.layers:
+            layer.zero_grad()
+
     def parameters(self):
         # Get the parameters of the MLP
         return [p for layer in self.layers for p in layer.parameters()]
@@ -1,5 +1,28 @@
 import setuptools
 
+try:
+    from Cython.Build import cythonize
+except ImportError:
+    # Cython is optional, without it micrograd stays pure Python.
+    cythonize = None
+
+# Compile the autograd engine to a C extension when Cython is available. The
+# extension takes precedence over `engine.py` on import, which remains the
+# pure Python fallback. Annotation typing is turned off so that `data: float`
+# does not get turned into a C double (ints and numpy arrays are valid data).
+# The extension is optional: if it fails to build (e.g. there is no C
+# compiler) the install goes on with the pure Python engine.
+ext_modules = []
+if cythonize is not None:
+    ext_modules = cythonize(
+        "micrograd/engine.py",
+        compiler_directives={"language_level": 3, "annotation_typing": False},
+    )
+    # `cythonize` creates the extensions anew and drops `optional` from the
+    # ones given to it, so it is set on its output.
+    for ext in ext_modules:
+        ext.optional = True
+
 with open("README.md", "r") as fh:
     long_description = fh.read()
 
@@ -13,6 +36,8 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/karpathy/micrograd",
     packages=setuptools.find_packages(),
+    install_requires=["numpy"],
+    ext_modules=ext_modules,
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
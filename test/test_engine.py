@@ -1,6 +1,11 @@
+import sys
+
+import numpy as np
+import pytest
 import torch
 
-from micrograd.engine import Value
+from micrograd import engine
+from micrograd.engine import TensorValue, Value
 
 
 def test_sanity_check():
@@ -68,3 +73,256 @@ def test_more_ops():
     # backward pass went well
     assert abs(amg.grad - apt.grad.item()) < tol
     assert abs(bmg.grad - bpt.grad.item()) < tol
+
+
+def test_deep_graph():
+
+    # a chain much deeper than the recursion limit of Python
+    x = Value(1.0)
+    y = x
+    for _ in range(5000):
+        y = y * 1.0 + 1.0
+    y.backward()
+
+    # forward pass went well
+    assert y.data == 5001.0
+    # backward pass went well
+    assert x.grad == 1.0
+
+
+def test_dot():
+
+    ws = [Value(0.5), Value(-1.5), Value(2.0)]
+    xs = [Value(-4.0), Value(3.0), Value(1.0)]
+    b = Value(0.25)
+    y = Value.dot(ws, xs, b).relu() * xs[0]
+    y.backward()
+    wmg, xmg, bmg, ymg = ws, xs, b, y
+
+    ws = torch.Tensor([0.5, -1.5, 2.0]).double()
+    xs = torch.Tensor([-4.0, 3.0, 1.0]).double()
+    b = torch.Tensor([0.25]).double()
+    ws.requires_grad = True
+    xs.requires_grad = True
+    b.requires_grad = True
+    y = ((ws * xs).sum() + b).relu() * xs[0]
+    y.backward()
+    wpt, xpt, bpt, ypt = ws, xs, b, y
+
+    tol = 1e-6
+    # forward pass went well
+    assert abs(ymg.data - ypt.data.item()) < tol
+    # backward pass went well
+    assert all(abs(w.grad - g) < tol for w, g in zip(wmg, wpt.grad.tolist()))
+    assert all(abs(x.grad - g) < tol for x, g in zip(xmg, xpt.grad.tolist()))
+    assert abs(bmg.grad - bpt.grad.item()) < tol
+
+    # the weights and inputs have to pair up
+    with pytest.raises(AssertionError):
+        Value.dot(wmg, xmg[:2], bmg)
+
+
+def test_constants():
+
+    x = Value(3.0)
+    y = (5 - x) * (2.0 - x) / (1 - x) + 2 * x * 0.5 - 1
+    y.backward()
+    xmg, ymg = x, y
+
+    x = torch.Tensor([3.0]).double()
+    x.requires_grad = True
+    y = (5 - x) * (2.0 - x) / (1 - x) + 2 * x * 0.5 - 1
+    y.backward()
+    xpt, ypt = x, y
+
+    tol = 1e-6
+    # forward pass went well
+    assert abs(ymg.data - ypt.data.item()) < tol
+    # backward pass went well
+    assert abs(xmg.grad - xpt.grad.item()) < tol
+
+
+def test_batch():
+
+    xs = [[1.0, -2.0, 0.5], [3.0, 1.0, -1.5]]
+    w = Value(0.5)
+    b = Value(-1.0)
+    x0 = Value([x[0] for x in xs])
+    x1 = Value([x[1] for x in xs])
+    x2 = Value([x[2] for x in xs])
+    y = (x0 * w + x1 / (b - 1) + x2 ** 2).relu() * 3 + b
+    y.backward()
+    wmg, bmg, ymg = w, b, y
+
+    w = torch.Tensor([0.5]).double()
+    b = torch.Tensor([-1.0]).double()
+    w.requires_grad = True
+    b.requires_grad = True
+    x = torch.Tensor(xs).double()
+    y = (x[:, 0] * w + x[:, 1] / (b - 1) + x[:, 2] ** 2).relu() * 3 + b
+    y.sum().backward()
+    wpt, bpt, ypt = w, b, y
+
+    tol = 1e-6
+    # forward pass went well
+    assert all(abs(a - b) < tol for a, b in zip(ymg.data, ypt.data.tolist()))
+    # backward pass went well, the gradients are summed over the batch
+    assert abs(wmg.grad - wpt.grad.item()) < tol
+    assert abs(bmg.grad - bpt.grad.item()) < tol
+
+
+def test_affine_relu():
+
+    for data in ([-4.0, 3.0], [[-4.0, 1.0], [3.0, 2.0]]):
+        ws = [Value(0.5), Value(-1.5)]
+        xs = [Value(x) for x in data]
+        b = Value(0.25)
+        y = Value.affine_relu(ws, xs, b) * 2
+        y.backward()
+
+        wr = [Value(0.5), Value(-1.5)]
+        xr = [Value(x) for x in data]
+        br = Value(0.25)
+        yr = Value.dot(wr, xr, br).relu() * 2
+        yr.backward()
+
+        # the fused node matches the dot product followed by relu
+        assert np.array_equal(y.data, yr.data)
+        for v, vr in zip(ws + xs + [b], wr + xr + [br]):
+            assert np.array_equal(v.grad, vr.grad)
+
+
+def test_free_graph():
+
+    def step(free):
+        a = Value(-4.0)
+        b = Value(2.0)
+        c = (a * b + b ** 3).relu() + (b - a) / a
+        y = c * c + a
+        y.backward(free=free)
+        return [a, b], y
+
+    params, y = step(False)
+    for _ in range(3):
+        # the nodes freed by the last step are reused by the next one
+        paramsf, yf = step(True)
+        assert yf.data == y.data
+        assert all(p.grad == pf.grad for p, pf in zip(params, paramsf))
+
+    # the output is left as a leaf
+    assert yf._prev == ()
+
+
+def test_free_graph_shared(monkeypatch):
+
+    def losses(free):
+        a = Value(3.0)
+        b = Value(-2.0)
+        h = (a * b + 1.0).relu() + a * b
+        l1 = h * 2.0
+        l2 = h * h + (a * b) ** 2
+        l1.backward(free=free)
+        # the new nodes reuse the freed ones
+        [Value(1.0) * 2.0 + 1.0 for _ in range(10)]
+        l2.backward()
+        return a, b, h, l2
+
+    # the nodes shared with a second loss and the ones still held are kept
+    a, b, h, l2 = losses(False)
+    af, bf, hf, l2f = losses(True)
+    assert (af.grad, bf.grad) == (a.grad, b.grad)
+    assert (hf.data, l2f.data) == (h.data, l2.data)
+
+    # a large graph does not stay in the pool for good
+    s = Value(0.0)
+    for _ in range(2 * engine._VALUE_POOL_SIZE):
+        s = s + Value(1.0)
+    s.backward(free=True)
+    assert len(engine._value_pool) <= engine._VALUE_POOL_SIZE
+
+    # without reference counts nothing is pooled
+    monkeypatch.delattr(sys, "getrefcount")
+    engine._value_pool.clear()
+    af, bf, hf, l2f = losses(True)
+    assert (af.grad, bf.grad) == (a.grad, b.grad)
+    assert (hf.data, l2f.data) == (h.data, l2.data)
+    assert not engine._value_pool
+
+
+def test_batch_accumulate():
+
+    for data in (0.5, [0.5]):
+        w = Value(data)
+        b = Value(-1.0)
+        x = Value([1.0, 2.0, 3.0])
+        (w * x + b).backward()
+        (w * x).relu().backward()
+
+        # the gradients of the two losses add up, each summed over the batch
+        assert np.allclose(w.grad, 12.0)
+        assert b.grad == 3.0
+        assert np.array_equal(x.grad, [1.0, 1.0, 1.0])
+        assert np.shape(w.grad) == np.shape(w.data)
+
+
+def test_tensor_indexing():
+
+    x = TensorValue([1.0, 2.0, 3.0])
+    y = x[[0, 0, 2]].relu()
+    y.backward()
+    z = x[1] * 2.0 + x[0]
+    z.backward()
+
+    # an entry picked twice gets both gradients
+    assert np.array_equal(y.data, [1.0, 1.0, 3.0])
+    assert np.array_equal(x.grad, [3.0, 2.0, 1.0])
+
+
+def test_cached_topo():
+
+    def build():
+        a = Value(-4.0)
+        b = Value(2.0)
+        c = (a * b + b ** 3).relu() + (b - a) / a
+        y = c * c + a
+        return a, b, y
+
+    a, b, y = build()
+    y.backward()
+    grads = (a.grad, b.grad)
+
+    # the second pass takes the cached order, which matches a fresh sort
+    assert y._topo is not None
+    assert engine._cached_topo(y) == engine._build_topo(y)
+    y.backward()
+    assert (a.grad, b.grad) == (2 * grads[0], 2 * grads[1])
+
+    # the cut graph is sorted again, the root is a leaf then
+    y.backward(free=True)
+    assert (a.grad, b.grad) == (3 * grads[0], 3 * grads[1])
+    assert y._topo is None
+    y.backward()
+    assert engine._cached_topo(y) == [y]
+    assert (a.grad, b.grad) == (3 * grads[0], 3 * grads[1])
+    assert y.grad == 1
+
+    # a fresh graph after the freed one gets the gradients of a single pass
+    a, b, y = build()
+    y.backward()
+    assert (a.grad, b.grad) == grads
+
+
+def test_batch_mixed():
+
+    # an entry of a tensor times a batch gets the gradient summed over it
+    t = TensorValue([1.0, 2.0])
+    y = t[0] * Value([1.0, 2.0, 3.0])
+    y.backward()
+    assert np.array_equal(t.grad, [6.0, 0.0])
+
+    # a leaf reached both by a batch and by a node summed over the batch
+    b = Value(-1.0)
+    x = Value([-2.0, 1.0])
+    y = x / (b - 1) + b
+    y.backward()
+    assert b.grad == 2.25
@@ -0,0 +1,187 @@
+import numpy as np
+import torch
+
+from micrograd.engine import Value, compile
+from micrograd.nn import MLP, Layer
+
+
+def test_mlp_matches_torch():
+
+    np.random.seed(1337)
+    model = MLP(3, [4, 4, 1])
+    x = [Value(1.0), Value(-2.0), Value(0.5)]
+    y = model(x)[0] * 2.0
+    y.backward()
+    ymg, xmg = y, x
+
+    x = torch.Tensor([1.0, -2.0, 0.5]).double()
+    x.requires_grad = True
+    params = []
+    h = x
+    for layer in model.layers:
+        W = torch.tensor(layer.W.data, requires_grad=True)
+        b = torch.tensor(layer.b.data, requires_grad=True)
+        params += [W, b]
+        h = W @ h + b
+        h = h.relu() if layer.nonlin else h
+    y = h[0] * 2.0
+    y.backward()
+    ypt, xpt = y, x
+
+    tol = 1e-6
+    # forward pass went well
+    assert abs(ymg.data - ypt.data.item()) < tol
+    # backward pass went well
+    for p, ppt in zip(model.parameters(), params):
+        assert np.allclose(p.grad, ppt.grad.numpy(), atol=tol)
+    for xi, gi in zip(xmg, xpt.grad.tolist()):
+        assert abs(xi.grad - gi) < tol
+
+
+def test_zero_grad():
+
+    model = MLP(3, [4, 1])
+    model([1.0, -2.0, 0.5]).backward()
+    grads = [p.grad for p in model.parameters()]
+    model.zero_grad()
+
+    # the gradients are zeroed in place
+    for p, g in zip(model.parameters(), grads):
+        assert p.grad is g
+        assert not p.grad.any()
+
+
+def test_compiled_graph():
+
+    np.random.seed(1337)
+    model = MLP(3, [4, 4, 1])
+    graph = compile(model, np.zeros((2, 3)))
+
+    # replay the recorded graph on new inputs, then on a new batch size
+    for x in [np.random.randn(2, 3), np.random.randn(2, 3), np.random.randn(5, 3)]:
+        model.zero_grad()
+        y = graph.step(x)
+        grads = [p.grad.copy() for p in model.parameters()]
+
+        model.zero_grad()
+        yref = model(x)
+        yref.backward()
+
+        assert np.allclose(y, yref.data)
+        for p, g in zip(model.parameters(), grads):
+            assert np.allclose(p.grad, g)
+
+
+def test_layer_inputs():
+
+    np.random.seed(1337)
+    model = MLP(3, [4, 2])
+    x = [Value(1.0), -2.0, Value(0.5)]
+    y = model(x)
+    y[1].backward()
+
+    # plain numbers can be mixed with Value nodes in the input
+    yref = model([1.0, -2.0, 0.5])
+    assert np.allclose(y.data, yref.data)
+    assert x[0].grad != 0.0
+
+    # a row of a batched output, and a single entry of it
+    X = np.array([[1.0, -2.0, 0.5], [0.5, 1.0, -1.0]])
+    Y = model(X)
+    assert np.allclose(Y[0].data, yref.data)
+    assert Y[0, 1].data == Y.data[0, 1]
+    model.zero_grad()
+    (Y[0][1] + Y[1, 0]).backward()
+    g = model.layers[-1].b.grad.copy()
+    assert np.allclose(g, [1.0, 1.0])
+
+
+def test_compiled_graph_loss():
+
+    np.random.seed(1337)
+    model = MLP(3, [4, 4, 2])
+    graph = compile(model, np.zeros((5, 3)))
+    X = np.random.randn(5, 3)
+    Y = np.random.randn(5, 2)
+
+    # the gradient of the mean squared error, as a function and an array
+    out = graph.step(X, lambda out: 2 * (out - Y) / out.size)
+    grads = [p.grad.copy() for p in model.parameters()]
+    model.zero_grad()
+    graph.step(X, 2 * (out - Y) / out.size)
+    for p, g in zip(model.parameters(), grads):
+        assert np.allclose(p.grad, g)
+
+    params = []
+    h = torch.tensor(X)
+    for layer in model.layers:
+        W = torch.tensor(layer.W.data, requires_grad=True)
+        b = torch.tensor(layer.b.data, requires_grad=True)
+        params += [W, b]
+        h = h @ W.T + b
+        h = h.relu() if layer.nonlin else h
+    loss = ((h - torch.tensor(Y)) ** 2).mean()
+    loss.backward()
+
+    tol = 1e-6
+    # forward pass went well
+    assert np.allclose(out, h.detach().numpy(), atol=tol)
+    # backward pass went well
+    for g, ppt in zip(grads, params):
+        assert np.allclose(g, ppt.grad.numpy(), atol=tol)
+
+
+def test_batched_value_inputs():
+
+    np.random.seed(1337)
+    model = MLP(3, [4, 4, 2])
+    X = [[1.0, -2.0, 0.5], [0.5, 1.0, -1.0], [-1.5, 0.5, 2.0]]
+
+    # a list of Values holding the whole batch, the last input is shared
+    x = [Value([row[0] for row in X]), Value([row[1] for row in X]), Value(0.5)]
+    y = model(x)
+    y.backward()
+    grads = [p.grad.copy() for p in model.parameters()]
+
+    # the same examples one at a time
+    model.zero_grad()
+    shared = Value(0.5)
+    for i, row in enumerate(X):
+        xi = [Value(row[0]), Value(row[1]), shared]
+        yi = model(xi)
+        yi.backward()
+
+        # every example gets its own row of the output and its own gradients
+        assert np.allclose(y.data[i], yi.data)
+        assert np.isclose(x[0].grad[i], xi[0].grad)
+        assert np.isclose(x[1].grad[i], xi[1].grad)
+
+    # the parameters and the shared input get the gradients of the whole batch
+    assert np.isclose(x[2].grad, shared.grad)
+    for p, g in zip(model.parameters(), grads):
+        assert np.allclose(p.grad, g)
+
+
+def test_batched_value_nodes():
+
+    np.random.seed(1337)
+    layer = Layer(1, 2, nonlin=False)
+    W = layer.W.data[:, 0]
+    x = Value([1.0, 2.0, 3.0])
+
+    # a Value node over a batch, below the stacked input of a layer
+    w = Value(0.5)
+    layer([w * x]).backward()
+    assert isinstance(w.grad, float)
+    assert np.isclose(w.grad, W.sum() * 6.0)
+
+    # the same through a scalar output
+    w = Value(0.5)
+    o = layer([w * x])
+    (o[0, 0] + o[1, 1]).backward()
+    assert np.isclose(w.grad, W[0] * 1.0 + W[1] * 2.0)
+
+    # a weight that is both stacked and used on the batch directly
+    w = Value(0.5)
+    (layer([w])[0] * x + w * x).backward()
+    assert np.isclose(w.grad, (W[0] + 1.0) * 6.0)